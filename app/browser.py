@@ -1,17 +1,36 @@
-from playwright.async_api import async_playwright, Browser, Page
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Route
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import asyncio
+import httpx
 import logging
 import re
+from collections import OrderedDict
 from typing import Optional, Dict
 
 logger = logging.getLogger(__name__)
 
+_SUBMIT_URL_RE = re.compile(r'https?://[^\s<>"]+/submit[^\s<>"]*')
+
+# Quiz pages only need HTML and JS; skip everything that just paints
+_BLOCKED_RESOURCES = "**/*.{png,jpg,jpeg,gif,svg,webp,woff,woff2,css,mp4}"
+
 
 class QuizBrowser:
     """Handles all browser automation for quiz solving"""
     
-    def __init__(self):
+    def __init__(self, pool_size: int = 4, download_cache_bytes: int = 256 * 1024 * 1024):
         self.playwright = None
         self.browser: Optional[Browser] = None
+        self.context: Optional[BrowserContext] = None
+        self.pool_size = pool_size
+        self._page_pool: "asyncio.Queue[Page]" = asyncio.Queue()
+        # Pool slots whose page died and couldn't be replaced yet
+        self._lost_pages = 0
+        self._http: Optional[httpx.AsyncClient] = None
+        # Quiz files don't change per URL, so keep recent downloads across requests
+        self._dl_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._dl_cache_size = 0
+        self.download_cache_bytes = download_cache_bytes
     
     async def start(self):
         """Initialize the browser"""
@@ -19,12 +38,39 @@ class QuizBrowser:
         self.playwright = await async_playwright().start()
         self.browser = await self.playwright.chromium.launch(
             headless=True,  # Run without GUI
-            args=['--no-sandbox', '--disable-setuid-sandbox']  # Required for some Linux environments
+            args=[
+                '--no-sandbox', '--disable-setuid-sandbox',  # Required for some Linux environments
+                '--disable-dev-shm-usage',
+                '--disable-gpu',
+                '--disable-extensions',
+                '--disable-background-networking',
+                '--disable-features=TranslateUI,BackForwardCache',
+                '--blink-settings=imagesEnabled=false'
+            ]
         )
-        logger.info("Browser started successfully")
+        
+        # Warm a pool of pages in one shared context so requests don't pay page setup
+        self.context = await self.browser.new_context(java_script_enabled=True)
+        self.context.set_default_navigation_timeout(15000)
+        await self.context.route(_BLOCKED_RESOURCES, self._abort_route)
+        self._page_pool = asyncio.Queue()
+        self._lost_pages = 0
+        for _ in range(self.pool_size):
+            self._page_pool.put_nowait(await self.context.new_page())
+        logger.info(f"Browser started successfully with {self.pool_size} pooled pages")
+    
+    @staticmethod
+    async def _abort_route(route: Route):
+        await route.abort()
     
     async def stop(self):
         """Clean up browser resources"""
+        if self._http:
+            await self._http.aclose()
+            self._http = None
+        if self.context:
+            await self.context.close()
+            self.context = None
         if self.browser:
             await self.browser.close()
         if self.playwright:
@@ -46,25 +92,30 @@ class QuizBrowser:
         
         logger.info(f"Fetching quiz page: {url}")
         
-        # Create a new page
-        page: Page = await self.browser.new_page()
+        # Borrow a warm page from the pool
+        page: Page = await self._acquire_page()
         
         try:
-            # Navigate to the URL and wait for content to load
-            await page.goto(url, wait_until="networkidle", timeout=15000)
+            # Navigate, then wait only until the quiz script has rendered #result
+            await page.goto(url, wait_until="domcontentloaded", timeout=15000)
             
-            # Wait a bit for JavaScript to execute
-            await page.wait_for_timeout(500)
+            try:
+                await page.locator("#result").wait_for(state="visible", timeout=8000)
+                has_result = True
+            except PlaywrightTimeoutError:
+                # No #result on this page; let it finish loading before reading the body
+                await page.wait_for_load_state("load")
+                has_result = False
             
             # Get the rendered content
             content = await page.content()
             
-            # Try to extract text from #result first, fallback to body
-            try:
-                result_text = await page.locator("#result").inner_text(timeout=5000)
+            # Extract text from #result if present, fallback to body
+            if has_result:
+                result_text = await page.locator("#result").inner_text()
                 result_html = await page.locator("#result").inner_html()
                 logger.info("Extracted content from #result element")
-            except:
+            else:
                 # Fallback: get all text from body
                 result_text = await page.locator("body").inner_text()
                 result_html = await page.locator("body").inner_html()
@@ -87,8 +138,37 @@ class QuizBrowser:
             logger.error(f"Error fetching quiz page: {e}")
             raise
         finally:
-            await page.close()
-
+            await self._release_page(page)
+    
+    async def _acquire_page(self, timeout: float = 30.0) -> Page:
+        """Take a page from the pool, recreating lost pages first if the pool is empty"""
+        if self._page_pool.empty() and self._lost_pages > 0:
+            page = await self.context.new_page()
+            self._lost_pages -= 1
+            return page
+        try:
+            return await asyncio.wait_for(self._page_pool.get(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"No browser page became available within {timeout}s")
+    
+    async def _release_page(self, page: Page):
+        """Reset a pooled page and return it, replacing it if it can no longer be used"""
+        try:
+            await page.goto("about:blank")
+        except Exception as e:
+            logger.warning(f"Replacing pooled page after reset failure: {e}")
+            try:
+                await page.close()
+            except Exception:
+                pass
+            try:
+                page = await self.context.new_page()
+            except Exception as e:
+                # Don't mask the caller's error; the slot is recreated on next acquire
+                logger.error(f"Could not replace pooled page: {e}")
+                self._lost_pages += 1
+                return
+        self._page_pool.put_nowait(page)
     
     def _extract_submit_url(self, text: str) -> Optional[str]:
         """
@@ -98,9 +178,7 @@ class QuizBrowser:
         - "Post your answer to https://example.com/submit"
         - "Submit to: https://example.com/submit"
         """
-        # Pattern to find URLs in the text
-        url_pattern = r'https?://[^\s<>"]+/submit[^\s<>"]*'
-        match = re.search(url_pattern, text)
+        match = _SUBMIT_URL_RE.search(text)
         
         if match:
             url = match.group(0)
@@ -116,32 +194,50 @@ class QuizBrowser:
         """
         Download a file from a URL
         
+        Plain files need no JavaScript, so this uses a keep-alive HTTP client
+        rather than the browser.
+        
         Args:
             url: The file URL to download
             
         Returns:
             File content as bytes
         """
-        if not self.browser:
-            await self.start()
+        if not self._http:
+            self._http = httpx.AsyncClient(
+                http2=True,
+                timeout=30.0,
+                follow_redirects=True,
+                limits=httpx.Limits(max_keepalive_connections=10)
+            )
+        
+        if url in self._dl_cache:
+            self._dl_cache.move_to_end(url)
+            logger.info(f"Using cached download: {url}")
+            return self._dl_cache[url]
         
         logger.info(f"Downloading file: {url}")
         
-        page = await self.browser.new_page()
+        response = await self._http.get(url)
+        if response.is_error:
+            raise Exception(f"Failed to download file: HTTP {response.status_code}")
         
-        try:
-            # Use page.request to download files
-            response = await page.request.get(url)
-            
-            if response.ok:
-                file_content = await response.body()
-                logger.info(f"Downloaded {len(file_content)} bytes")
-                return file_content
-            else:
-                raise Exception(f"Failed to download file: HTTP {response.status}")
-                
-        finally:
-            await page.close()
+        file_content = response.content
+        logger.info(f"Downloaded {len(file_content)} bytes")
+        self._cache_download(url, file_content)
+        return file_content
+    
+    def _cache_download(self, url: str, content: bytes):
+        """Remember a download, evicting the oldest entries beyond the byte budget"""
+        if len(content) > self.download_cache_bytes:
+            return
+        if url in self._dl_cache:
+            self._dl_cache_size -= len(self._dl_cache.pop(url))
+        self._dl_cache[url] = content
+        self._dl_cache_size += len(content)
+        while self._dl_cache_size > self.download_cache_bytes:
+            _, evicted = self._dl_cache.popitem(last=False)
+            self._dl_cache_size -= len(evicted)
 
 
 # Global browser instance
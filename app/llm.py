@@ -1,17 +1,282 @@
 import os
-import json
+import orjson
+import hashlib
 import logging
 import re
-from typing import Dict, Any, Optional
-from openai import OpenAI
+import shelve
+import time
+import warnings
+from collections import OrderedDict
+from typing import Dict, Any, List, Literal, Optional, Tuple, Type, TypeVar, Union
+import numpy as np
+from openai import AsyncOpenAI
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+_BASE_URL_RE = re.compile(r'https?://[^/\s]+')
+_CSV_HREF_RE = re.compile(r'href\s*=\s*["\']([^"\']*\.csv[^"\']*)["\']', re.IGNORECASE)
+_CSV_URL_RE = re.compile(r'https?://[^\s\]<>"\']+\.csv')
+_CUTOFF_RE = re.compile(r'cutoff[:\s]+(\d+)', re.IGNORECASE)
+_KEYWORD_RE = re.compile(r'\w{4,}')
+
+_INT64 = np.iinfo(np.int64)
+
+# Roughly 8k tokens of context per prompt
+CONTEXT_CHAR_BUDGET = 32000
+
+SCRAPING_SYSTEM_PROMPT = "You are a web scraping and data extraction expert. Always respond with valid JSON."
+
 # Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+# Structured-output schemas the model must follow
+class Analysis(BaseModel):
+    task_type: Literal["data_analysis", "pdf_extraction", "web_scraping", "visualization", "calculation", "text_question"]
+    files_to_download: List[str]
+    submit_url: Optional[str]
+    quiz_url: Optional[str]
+    instructions: str
+    answer_format: Literal["number", "string", "boolean", "object", "base64_file"]
+
+
+class ScrapeTarget(BaseModel):
+    scrape_url: str
+    what_to_find: str
+
+
+class AnswerOut(BaseModel):
+    answer: Union[int, float, bool, str]
+
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+
+def select_relevant_text(chunks: List[str], question: str, budget: int = CONTEXT_CHAR_BUDGET,
+                         separator: str = "\n") -> str:
+    """
+    Keep the chunks most relevant to the question, within a character budget
+    
+    Chunks are ranked by how many of the question's keywords (words of 4+
+    characters) they contain, then the best ones are re-joined in their
+    original order. Text already under budget is returned unchanged.
+    """
+    text = separator.join(chunks)
+    if len(text) <= budget:
+        return text
+    
+    keywords = {kw.lower() for kw in _KEYWORD_RE.findall(question)}
+    scores = [sum(1 for kw in keywords if kw in chunk.lower()) for chunk in chunks]
+    ranked = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+    
+    selected = []
+    used = 0
+    for i in ranked:
+        cost = len(chunks[i]) + len(separator)
+        if used + cost > budget:
+            continue
+        selected.append(i)
+        used += cost
+    
+    if not selected:
+        # Even the best chunk is over budget; send its head
+        return chunks[ranked[0]][:budget]
+    
+    logger.info(f"Trimmed context from {len(text)} to {used} chars ({len(selected)}/{len(chunks)} chunks)")
+    return separator.join(chunks[i] for i in sorted(selected))
+
+
+def parse_csv_numbers(csv_text: str) -> np.ndarray:
+    """
+    Parse a single-column CSV of integers into an int64 array
+    
+    Uses NumPy's C parser; if the text contains anything else (a header,
+    stray text), falls back to a single pass keeping every line that parses
+    as an integer, including negative ones. When the values or their sum
+    may not fit in int64, an object array of Python ints is returned
+    instead so totals stay exact.
+    """
+    try:
+        with warnings.catch_warnings():
+            # Older NumPy only warns on unparsable trailing data
+            warnings.simplefilter("error", DeprecationWarning)
+            numbers = np.fromstring(csv_text, sep='\n', dtype=np.int64)
+        if numbers.size and (numbers.max() == _INT64.max or numbers.min() == _INT64.min):
+            # fromstring clamps out-of-range values instead of failing; reparse exactly
+            numbers = _to_array([n for n in map(_parse_int, csv_text.split()) if n is not None])
+    except (ValueError, DeprecationWarning):
+        numbers = _to_array([n for n in map(_parse_int, csv_text.split('\n')) if n is not None])
+    
+    if numbers.dtype != object and numbers.size:
+        # Worst-case magnitude of any sum over these values
+        bound = max(int(numbers.max()), -int(numbers.min())) * numbers.size
+        if bound > _INT64.max:
+            numbers = numbers.astype(object)
+    return numbers
+
+
+def _to_array(numbers: List[int]) -> np.ndarray:
+    try:
+        return np.array(numbers, dtype=np.int64)
+    except OverflowError:
+        return np.array(numbers, dtype=object)
+
+
+def _parse_int(line: str) -> Optional[int]:
+    try:
+        return int(line)
+    except ValueError:
+        return None
+
+
+class LLMCache:
+    """
+    In-process cache for LLM JSON completions
+
+    Exact hits are keyed by a hash of (model, messages, temperature) and kept in
+    an LRU with a TTL. An optional fuzzy tier matches near-duplicate prompts by
+    cosine similarity of their embeddings. Entries are mirrored to a shelve
+    file (when a path is given) so restarts keep the cache warm.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 24 * 3600,
+                 path: Optional[str] = None, similarity_threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._expires: Dict[str, float] = {}
+        self._scopes: Dict[str, str] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._matrix_scopes: Optional[np.ndarray] = None
+        self._shelf = None
+        
+        if path:
+            try:
+                self._shelf = shelve.open(path)
+                self._load()
+            except Exception as e:
+                logger.warning(f"Could not open LLM cache file {path}: {e}")
+                self._shelf = None
+    
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, schema: str) -> str:
+        """Exact-match key for a completion request"""
+        payload = orjson.dumps({"model": model, "messages": messages, "temperature": temperature, "schema": schema},
+                               option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+    
+    @staticmethod
+    def make_scope(model: str, system: str, temperature: float, schema: str) -> str:
+        """Fuzzy matches are only allowed between prompts sharing model, system prompt, temperature and schema"""
+        payload = orjson.dumps({"model": model, "system": system, "temperature": temperature, "schema": schema},
+                               option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached completion for an exact key, or None"""
+        if key not in self._entries:
+            return None
+        if self._expires[key] < time.time():
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+    
+    def get_similar(self, scope: str, vector: np.ndarray) -> Optional[Tuple[str, str]]:
+        """Return (key, completion) for the entry whose prompt embedding is closest to vector, if above threshold"""
+        if not self._vectors:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = list(self._vectors)
+            self._matrix = np.stack([self._vectors[k] for k in self._matrix_keys])
+            self._matrix_scopes = np.array([self._scopes[k] for k in self._matrix_keys])
+        
+        scores = self._matrix @ self._normalize(vector)
+        scores[self._matrix_scopes != scope] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        
+        key = self._matrix_keys[best]
+        content = self.get(key)
+        if content is None:
+            return None
+        logger.info(f"LLM cache fuzzy hit (similarity {scores[best]:.3f})")
+        return key, content
+    
+    def discard(self, key: str):
+        """Drop an entry, e.g. one that no longer matches its expected schema"""
+        self._evict(key)
+    
+    def set(self, key: str, content: str, scope: Optional[str] = None,
+            vector: Optional[np.ndarray] = None, expires_at: Optional[float] = None):
+        """Store a completion, evicting the least recently used entries beyond maxsize"""
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self._entries[key] = content
+        self._entries.move_to_end(key)
+        self._expires[key] = expires_at
+        if scope is not None and vector is not None:
+            self._scopes[key] = scope
+            self._vectors[key] = self._normalize(vector)
+            self._matrix = None
+        
+        if self._shelf is not None:
+            self._shelf[key] = (expires_at, content, scope, self._vectors.get(key))
+        
+        while len(self._entries) > self.maxsize:
+            self._evict(next(iter(self._entries)))
+    
+    def close(self):
+        """Flush and close the backing file"""
+        if self._shelf is not None:
+            self._shelf.close()
+            self._shelf = None
+    
+    def _evict(self, key: str):
+        self._entries.pop(key, None)
+        self._expires.pop(key, None)
+        self._scopes.pop(key, None)
+        if self._vectors.pop(key, None) is not None:
+            self._matrix = None
+        if self._shelf is not None and key in self._shelf:
+            del self._shelf[key]
+    
+    def _load(self):
+        """Restore unexpired entries from the backing file, oldest first"""
+        now = time.time()
+        stored = []
+        for key in list(self._shelf.keys()):
+            expires_at, content, scope, vector = self._shelf[key]
+            if expires_at < now:
+                del self._shelf[key]
+            else:
+                stored.append((expires_at, key, content, scope, vector))
+        
+        for expires_at, key, content, scope, vector in sorted(stored)[-self.maxsize:]:
+            self.set(key, content, scope, vector, expires_at)
+        logger.info(f"Loaded {len(self._entries)} cached LLM responses")
+    
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# Global cache instance; LLM_CACHE_PATH="" keeps it in memory only
+llm_cache = LLMCache(path=os.getenv("LLM_CACHE_PATH", ".llm_cache") or None)
+# Fuzzy matching costs an extra embeddings round-trip before every cache miss's completion
+LLM_CACHE_FUZZY = os.getenv("LLM_CACHE_FUZZY", "").lower() in ("1", "true", "yes")
 
 
 class QuizSolver:
@@ -21,6 +286,52 @@ class QuizSolver:
         self.model = model
         logger.info(f"QuizSolver initialized with model: {model}")
     
+    async def _complete(self, system: str, user: str, schema: Type[SchemaT]) -> SchemaT:
+        """Run a structured-output chat completion, served from llm_cache when possible"""
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user}
+        ]
+        key = LLMCache.make_key(self.model, messages, 0, schema.__name__)
+        hit_key = key
+        content = llm_cache.get(key)
+        
+        scope = vector = None
+        if content is None and LLM_CACHE_FUZZY:
+            try:
+                embedding = await client.embeddings.create(model=EMBEDDING_MODEL, input=user)
+                vector = np.array(embedding.data[0].embedding, dtype=np.float32)
+                scope = LLMCache.make_scope(self.model, system, 0, schema.__name__)
+            except Exception as e:
+                # The cache is only an optimization; carry on with a plain miss
+                logger.warning(f"Embedding lookup for LLM cache failed: {e}")
+            if vector is not None:
+                similar = llm_cache.get_similar(scope, vector)
+                if similar is not None:
+                    hit_key, content = similar
+        
+        if content is not None:
+            try:
+                result = schema.model_validate_json(content)
+                logger.info("LLM cache hit")
+                return result
+            except ValidationError as e:
+                # Stale or mismatched entry; treat as a miss
+                logger.warning(f"Discarding cached LLM response that doesn't match {schema.__name__}: {e}")
+                llm_cache.discard(hit_key)
+        
+        response = await client.chat.completions.parse(
+            model=self.model,
+            messages=messages,
+            temperature=0,
+            response_format=schema
+        )
+        message = response.choices[0].message
+        if message.parsed is None:
+            raise Exception(f"LLM returned no structured output: {message.refusal}")
+        llm_cache.set(key, message.content, scope, vector)
+        return message.parsed
+    
     async def analyze_quiz(self, quiz_text: str) -> Dict[str, Any]:
         """Analyze the quiz question to understand what needs to be done"""
         logger.info("Analyzing quiz with LLM...")
@@ -41,19 +352,13 @@ Provide your analysis in JSON format with these fields:
 Respond ONLY with valid JSON, no markdown formatting."""
 
         try:
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a precise quiz analyzer. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
+            analysis = await self._complete(
+                "You are a precise quiz analyzer. Always respond with valid JSON.",
+                prompt,
+                Analysis
             )
-            
-            analysis = json.loads(response.choices[0].message.content)
-            logger.info(f"Quiz analysis complete: {analysis['task_type']}")
-            return analysis
+            logger.info(f"Quiz analysis complete: {analysis.task_type}")
+            return analysis.model_dump()
             
         except Exception as e:
             logger.error(f"Error analyzing quiz: {e}")
@@ -80,18 +385,12 @@ Expected answer format: {analysis['answer_format']}
 Provide ONLY the answer value, no explanation. Format your response as JSON with a single field "answer"."""
 
         try:
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a quiz solver. Provide concise, accurate answers."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
+            result = await self._complete(
+                "You are a quiz solver. Provide concise, accurate answers.",
+                prompt,
+                AnswerOut
             )
-            
-            result = json.loads(response.choices[0].message.content)
-            answer = result.get("answer")
+            answer = result.answer
             logger.info(f"Generated answer: {answer}")
             return answer
             
@@ -103,11 +402,14 @@ Provide ONLY the answer value, no explanation. Format your response as JSON with
         """Solve quiz that requires scraping additional pages"""
         logger.info("Quiz requires web scraping")
         
-        prompt = f"""Look at this quiz question and tell me what URL needs to be scraped.
-
-Quiz:
+        # Both prompts start with the same system message and quiz block so the
+        # extraction call can reuse OpenAI's cached prefix from the first one
+        shared_prefix = f"""Quiz:
 {quiz_text}
 
+"""
+        prompt = shared_prefix + f"""Look at this quiz question and tell me what URL needs to be scraped.
+
 Respond with JSON containing:
 1. "scrape_url": The URL/path that needs to be scraped (if relative, include it as-is)
 2. "what_to_find": What information to extract from that page
@@ -115,24 +417,14 @@ Respond with JSON containing:
 Respond ONLY with valid JSON."""
 
         try:
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a web scraping expert. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
-            )
-            
-            scrape_info = json.loads(response.choices[0].message.content)
-            scrape_url = scrape_info['scrape_url']
+            scrape_info = await self._complete(SCRAPING_SYSTEM_PROMPT, prompt, ScrapeTarget)
+            scrape_url = scrape_info.scrape_url
             
             logger.info(f"Need to scrape: {scrape_url}")
             
             # Handle relative URLs - build full URL from quiz URL
             if scrape_url.startswith('/'):
-                base_match = re.search(r'https?://[^/\s]+', quiz_text)
+                base_match = _BASE_URL_RE.search(quiz_text)
                 if not base_match:
                     logger.warning("Could not find base URL, using default")
                     base_url = "https://tds-llm-analysis.s-anand.net"
@@ -144,33 +436,22 @@ Respond ONLY with valid JSON."""
             
             # Scrape the page
             scraped_data = await browser.fetch_quiz_page(scrape_url)
-            scraped_text = scraped_data['question']
+            scraped_text = select_relevant_text(scraped_data['question'].split('\n'), quiz_text)
             
             logger.info(f"Scraped content (first 200 chars): {scraped_text[:200]}")
             
             # Ask LLM to extract the answer from scraped content
-            extract_prompt = f"""Extract the answer from this scraped content.
+            extract_prompt = shared_prefix + f"""Extract the answer from this scraped content.
 
-Original Question: {quiz_text}
-What to find: {scrape_info['what_to_find']}
+What to find: {scrape_info.what_to_find}
 
 Scraped Content:
 {scraped_text}
 
 Extract ONLY the answer value. Respond with JSON containing a single field "answer"."""
 
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a data extraction expert."},
-                    {"role": "user", "content": extract_prompt}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            answer = result['answer']
+            result = await self._complete(SCRAPING_SYSTEM_PROMPT, extract_prompt, AnswerOut)
+            answer = result.answer
             logger.info(f"Extracted answer from scraped page: {answer}")
             return answer
             
@@ -178,8 +459,13 @@ Extract ONLY the answer value. Respond with JSON containing a single field "answ
             logger.error(f"Error during web scraping: {e}")
             raise
 
-    async def solve_with_csv_analysis(self, quiz_data: Dict[str, Any], analysis: Dict[str, Any], browser) -> Any:
-        """Solve quiz that requires CSV data analysis"""
+    async def solve_with_csv_analysis(self, quiz_data: Dict[str, Any], analysis: Dict[str, Any], browser,
+                                      prefetched_bytes: Optional[Dict[str, bytes]] = None) -> Any:
+        """
+        Solve quiz that requires CSV data analysis
+        
+        prefetched_bytes maps file URLs already downloaded by the caller to their content.
+        """
         logger.info("Quiz requires CSV analysis")
         
         # Extract text and HTML from quiz_data
@@ -190,7 +476,7 @@ Extract ONLY the answer value. Respond with JSON containing a single field "answ
         csv_url = None
         
         # Try 1: Look for href="...csv" in HTML
-        href_match = re.search(r'href\s*=\s*["\']([^"\']*\.csv[^"\']*)["\']', quiz_html, re.IGNORECASE)
+        href_match = _CSV_HREF_RE.search(quiz_html)
         if href_match:
             csv_file = href_match.group(1)
             logger.info(f"Found CSV file reference: {csv_file}")
@@ -205,7 +491,7 @@ Extract ONLY the answer value. Respond with JSON containing a single field "answ
         
         # Try 2: Look for direct CSV URLs in text
         if not csv_url:
-            urls = re.findall(r'https?://[^\s\]<>"\']+\.csv', quiz_text)
+            urls = _CSV_URL_RE.findall(quiz_text)
             if urls:
                 csv_url = urls[0]
                 logger.info(f"Found CSV URL from text: {csv_url}")
@@ -214,26 +500,29 @@ Extract ONLY the answer value. Respond with JSON containing a single field "answ
             logger.error("Could not find CSV URL")
             raise Exception("No CSV URL found in quiz")
         
-        # Download the CSV
-        csv_data = await browser.download_file(csv_url)
+        # Download the CSV unless the caller already fetched it
+        if prefetched_bytes and csv_url in prefetched_bytes:
+            csv_data = prefetched_bytes[csv_url]
+            logger.info("Using prefetched CSV")
+        else:
+            csv_data = await browser.download_file(csv_url)
         csv_text = csv_data.decode('utf-8')
         logger.info(f"Downloaded CSV, first 200 chars: {csv_text[:200]}")
         
         # Parse CSV and perform calculation
-        lines = csv_text.strip().split('\n')
-        numbers = [int(line.strip()) for line in lines if line.strip().isdigit()]
+        numbers = parse_csv_numbers(csv_text)
         logger.info(f"Parsed {len(numbers)} numbers from CSV")
         
         # Check if quiz mentions cutoff - task is to sum numbers ABOVE cutoff
-        cutoff_match = re.search(r'cutoff[:\s]+(\d+)', quiz_text, re.IGNORECASE)
+        cutoff_match = _CUTOFF_RE.search(quiz_text)
         if cutoff_match:
             cutoff = int(cutoff_match.group(1))
             # Sum of numbers ABOVE cutoff (not count!)
-            answer = sum(n for n in numbers if n > cutoff)
+            answer = int(numbers[numbers > cutoff].sum())
             logger.info(f"Sum of numbers > {cutoff}: {answer}")
         else:
             # No cutoff mentioned, sum all numbers
-            answer = sum(numbers)
+            answer = int(numbers.sum())
             logger.info(f"Sum of all numbers: {answer}")
         
         return answer
@@ -1,15 +1,20 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ValidationError
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
+import re
+import hmac
+import asyncio
 import logging
 from contextlib import asynccontextmanager
+from typing import Dict
 import httpx
 from app.solvers.pdf_solver import solve_pdf_analysis
 
 from app.browser import quiz_browser
-from app.llm import quiz_solver
+from app.llm import quiz_solver, llm_cache
 
 # Load environment variables
 load_dotenv()
@@ -31,19 +36,51 @@ if not SECRET_STRING or not EMAIL:
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY must be set in .env file")
 
+# Encoded once for constant-time comparison against each request
+_SECRET_BYTES = SECRET_STRING.encode()
+_EMAIL_BYTES = EMAIL.encode()
+
+
+# Direct links to data files that solvers may need
+_FILE_URL_RE = re.compile(r'https?://[^\s\]<>"\']+\.(?:csv|pdf)', re.IGNORECASE)
+
+
+async def prefetch_files(quiz_text: str) -> Dict[str, bytes]:
+    """Download every CSV/PDF linked in the quiz text, keyed by URL; failures are skipped"""
+    urls = list(dict.fromkeys(_FILE_URL_RE.findall(quiz_text)))
+    if not urls:
+        return {}
+    
+    results = await asyncio.gather(*(quiz_browser.download_file(url) for url in urls), return_exceptions=True)
+    prefetched = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Prefetch failed for {url}: {result}")
+        else:
+            prefetched[url] = result
+    return prefetched
+
 
 # Lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up application...")
     await quiz_browser.start()
+    # Shared client so submissions reuse connections to the submit host
+    app.state.http = httpx.AsyncClient(
+        timeout=30.0,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
     yield
     logger.info("Shutting down application...")
+    await app.state.http.aclose()
     await quiz_browser.stop()
+    llm_cache.close()
 
 
 # Initialize FastAPI app
-app = FastAPI(title="LLM Quiz Solver API", lifespan=lifespan)
+app = FastAPI(title="LLM Quiz Solver API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # Request model
@@ -53,6 +90,17 @@ class QuizRequest(BaseModel):
     url: str
 
 
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """Bad JSON or missing fields are reported as 400, not FastAPI's default 422"""
+    logger.error(f"Validation error: {exc.errors()}")
+    if any(error.get("type") == "json_invalid" for error in exc.errors()):
+        detail = "Invalid JSON payload"
+    else:
+        detail = "Missing required fields: email, secret, url"
+    return ORJSONResponse(status_code=400, content={"detail": detail})
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -65,31 +113,17 @@ async def root():
 
 
 @app.post("/solve")
-async def solve_quiz(request: Request):
+async def solve_quiz(quiz_request: QuizRequest):
     """Main endpoint to receive and solve quiz tasks"""
-    
-    # Parse JSON
-    try:
-        body = await request.json()
-        logger.info(f"Received request for URL: {body.get('url', 'unknown')}")
-    except Exception as e:
-        logger.error(f"Invalid JSON: {e}")
-        raise HTTPException(status_code=400, detail="Invalid JSON payload")
-    
-    # Validate request structure
-    try:
-        quiz_request = QuizRequest(**body)
-    except ValidationError as e:
-        logger.error(f"Validation error: {e}")
-        raise HTTPException(status_code=400, detail="Missing required fields: email, secret, url")
+    logger.info(f"Received request for URL: {quiz_request.url}")
     
     # Verify secret
-    if quiz_request.secret != SECRET_STRING:
+    if not hmac.compare_digest(quiz_request.secret.encode(), _SECRET_BYTES):
         logger.warning("Invalid secret provided")
         raise HTTPException(status_code=403, detail="Invalid secret")
     
     # Verify email
-    if quiz_request.email != EMAIL:
+    if not hmac.compare_digest(quiz_request.email.encode(), _EMAIL_BYTES):
         logger.warning("Email mismatch")
         raise HTTPException(status_code=403, detail="Invalid email")
     
@@ -100,34 +134,66 @@ async def solve_quiz(request: Request):
         quiz_data = await quiz_browser.fetch_quiz_page(quiz_request.url)
         logger.info("✓ Quiz page fetched")
         
-        # Step 2: Analyze quiz with LLM
-        analysis = await quiz_solver.analyze_quiz(quiz_data['question'])
-        logger.info(f"✓ Quiz analyzed - Type: {analysis['task_type']}")
+        question_lower = quiz_data['question'].lower()
+        is_demo = "anything you want" in question_lower
+        needs_files = 'pdf' in question_lower or 'csv' in question_lower or 'cutoff' in question_lower
+        # Direct links to the kind of file the dispatcher below would pick a solver for
+        file_ext = '.pdf' if 'pdf' in question_lower else '.csv'
+        file_urls = [url for url in _FILE_URL_RE.findall(quiz_data['question']) if url.lower().endswith(file_ext)]
+        
+        # The LLM analysis is also how relative submit paths get resolved, so
+        # only skip it when the page gave us an absolute submit URL
+        can_skip_analysis = quiz_data['submit_url'] is not None
         
-        # Step 3: Solve the quiz (for now, only simple quizzes)
-                # Step 3: Solve the quiz
-        if analysis['task_type'] == 'web_scraping':
+        # Step 2: Classify the quiz, only asking the LLM when the page itself gives no hint
+        if is_demo and can_skip_analysis:
+            logger.info("Detected demo quiz - skipping analysis")
+            analysis = {"task_type": "text_question"}
+            prefetched = {}
+        elif needs_files and file_urls and can_skip_analysis:
+            analysis = {
+                "task_type": "pdf_extraction" if 'pdf' in question_lower else "data_analysis",
+                "files_to_download": file_urls
+            }
+            logger.info(f"✓ Quiz links {len(file_urls)} file(s) - skipping analysis")
+            prefetched = await prefetch_files(quiz_data['question'])
+        else:
+            # Analyze quiz with LLM while speculatively downloading any linked files
+            analysis_task = asyncio.create_task(quiz_solver.analyze_quiz(quiz_data['question']))
+            prefetch_task = asyncio.create_task(prefetch_files(quiz_data['question']))
+            try:
+                analysis = await analysis_task
+            except Exception:
+                prefetch_task.cancel()
+                raise
+            logger.info(f"✓ Quiz analyzed - Type: {analysis['task_type']}")
+            
+            if needs_files and analysis['task_type'] != 'web_scraping':
+                prefetched = await prefetch_task
+            else:
+                prefetch_task.cancel()
+                prefetched = {}
+        
+        # Step 3: Solve the quiz
+        if is_demo:
+            answer = await quiz_solver.solve_simple_quiz(quiz_data['question'], analysis)
+        elif analysis['task_type'] == 'web_scraping':
             logger.info("Using web scraping solver")
             answer = await quiz_solver.solve_with_scraping(
                 quiz_data['question'], 
                 analysis, 
                 quiz_browser
             )
-        elif 'pdf' in quiz_data['question'].lower():
+        elif 'pdf' in question_lower:
             logger.info("Using PDF analysis solver")
-            answer = await solve_pdf_analysis(quiz_data, analysis, quiz_browser)
-
-        
-        
-        
-        elif 'csv' in quiz_data['question'].lower() or 'cutoff' in quiz_data['question'].lower():
-
-        
+            answer = await solve_pdf_analysis(quiz_data, analysis, quiz_browser, prefetched_bytes=prefetched)
+        elif 'csv' in question_lower or 'cutoff' in question_lower:
             logger.info("Using CSV analysis solver")
             answer = await quiz_solver.solve_with_csv_analysis(
                 quiz_data, 
                 analysis, 
-                quiz_browser
+                quiz_browser,
+                prefetched_bytes=prefetched
             )
         else:
             logger.info("Using simple solver")
@@ -160,13 +226,12 @@ async def solve_quiz(request: Request):
         logger.info(f"Submitting answer to: {submit_url}")
         
         # Submit the answer
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(submit_url, json=submission)
-            response_data = response.json()
+        response = await app.state.http.post(submit_url, json=submission)
+        response_data = response.json()
         
         logger.info(f"✓ Submission response: {response_data}")
         
-        # Return the result
+        # Return the result; stdlib JSON because answers can be ints wider than orjson's 64-bit limit
         return JSONResponse(
             status_code=200,
             content={
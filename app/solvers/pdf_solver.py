@@ -1,24 +1,55 @@
+import asyncio
 import logging
-import json
-import tempfile
-import os
-from typing import Dict, Any
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 import fitz
-from openai import OpenAI as OpenAIClient
+from openai import AsyncOpenAI
+from app.llm import AnswerOut, select_relevant_text
 
 logger = logging.getLogger(__name__)
-def get_client():
-    return OpenAIClient()
 
+_PDF_URL_RE = re.compile(r'https?://[^\s\]<>"\']+\.pdf', re.IGNORECASE)
 
-async def solve_pdf_analysis(quiz_data: Dict[str, Any], analysis: Dict[str, Any], browser) -> Any:
+_client = None
+
+# Single thread that owns all MuPDF work
+_pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+
+
+def get_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI()
+    return _client
+
+
+def _read_page_texts(pdf_data: bytes) -> List[str]:
+    """Open the PDF from memory, read every page's text and close it"""
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_doc:
+        return [pdf_doc[page_num].get_text() for page_num in range(pdf_doc.page_count)]
+
+
+async def extract_page_texts(pdf_data: bytes) -> List[str]:
+    """
+    Extract the text of every page without blocking the event loop
+    
+    MuPDF isn't safe to drive from several threads at once, so every PDF is
+    opened, read and closed entirely on one dedicated worker thread;
+    concurrent requests queue behind each other there.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pdf_executor, _read_page_texts, pdf_data)
+
+
+async def solve_pdf_analysis(quiz_data: Dict[str, Any], analysis: Dict[str, Any], browser,
+                             prefetched_bytes: Optional[Dict[str, bytes]] = None) -> Any:
     """Solve quiz that requires PDF data analysis"""
     logger.info("Quiz requires PDF analysis")
     
     quiz_text = quiz_data['question']
     
-    import re
-    pdf_urls = re.findall(r'https?://[^\s\]<>"\']+\.pdf', quiz_text, re.IGNORECASE)
+    pdf_urls = _PDF_URL_RE.findall(quiz_text)
     
     if not pdf_urls:
         logger.error("Could not find PDF URL")
@@ -27,26 +58,26 @@ async def solve_pdf_analysis(quiz_data: Dict[str, Any], analysis: Dict[str, Any]
     pdf_url = pdf_urls[0]
     logger.info(f"Found PDF URL: {pdf_url}")
     
-    pdf_data = await browser.download_file(pdf_url)
+    if prefetched_bytes and pdf_url in prefetched_bytes:
+        pdf_data = prefetched_bytes[pdf_url]
+    else:
+        pdf_data = await browser.download_file(pdf_url)
     logger.info(f"Downloaded PDF: {len(pdf_data)} bytes")
     
-    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-        tmp.write(pdf_data)
-        tmp_path = tmp.name
+    # Parsed straight from memory; no temp file round-trip
+    page_texts = await extract_page_texts(pdf_data)
+    logger.info(f"PDF has {len(page_texts)} pages")
+    pages = [
+        f"\n--- Page {page_num + 1} ---\n{text}"
+        for page_num, text in enumerate(page_texts)
+    ]
     
-    try:
-        pdf_doc = fitz.open(tmp_path)
-        logger.info(f"PDF has {pdf_doc.page_count} pages")
-        
-        full_text = ""
-        for page_num in range(pdf_doc.page_count):
-            page = pdf_doc[page_num]
-            text = page.get_text()
-            full_text += f"\n--- Page {page_num + 1} ---\n{text}"
-        
-        logger.info(f"Extracted text (first 300 chars): {full_text[:300]}")
-        
-        extract_prompt = f"""Extract the answer from this PDF.
+    # Only send the pages that look relevant to the question
+    full_text = select_relevant_text(pages, quiz_text, separator="")
+    
+    logger.info(f"Extracted text (first 300 chars): {full_text[:300]}")
+    
+    extract_prompt = f"""Extract the answer from this PDF.
 
 Question: {quiz_text}
 
@@ -57,23 +88,20 @@ Respond: {{"answer": <value>}}
 
 JSON only."""
 
-        client = get_client()
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Extract precise answers from PDF content."},
-                {"role": "user", "content": extract_prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        answer = result['answer']
-        logger.info(f"PDF answer: {answer}")
-        return answer
-        
-    finally:
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
-        pdf_doc.close()
+    client = get_client()
+    response = await client.chat.completions.parse(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Extract precise answers from PDF content."},
+            {"role": "user", "content": extract_prompt}
+        ],
+        temperature=0,
+        response_format=AnswerOut
+    )
+    
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise Exception(f"LLM returned no structured output: {message.refusal}")
+    answer = message.parsed.answer
+    logger.info(f"PDF answer: {answer}")
+    return answer